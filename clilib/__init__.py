@@ -43,7 +43,24 @@ The sequence may contain a mix of callables and tuples.
 
 The ``__call__`` method must be implemented and must take no
 arguments (apart from the invocant).  The command object is called
-to invoke its functionality.
+to invoke its functionality.  It may return an exit status, which
+``Dispatcher.run`` returns; ``None`` is treated as 0.
+
+Fan-out
+-------
+
+A command that applies the same operation to many targets may set
+the ``fanout`` class attribute to the ``dest`` of one of its
+arguments.  Its ``__call__`` method then takes a single target and
+is called for each value of that argument on a pool of threads.  A
+value of ``-`` reads targets from stdin, one per line, and
+``@path`` reads them from a file.  The ``fanout_workers``,
+``fanout_timeout`` and ``fanout_ordered`` attributes control the
+number of threads, the time allowed per target, and whether output
+is written in target order or as each target completes.  Each
+target's output is buffered so that output from different targets
+is not interleaved.  The exit status is the greatest status
+returned by any target.
 
 Pre-set attributes
 ------------------
@@ -63,6 +80,13 @@ object being called to invoke its functionality:
   A mapping of command aliases keyed by alias.
 ``config``
   A ``ConfigParser.SafeConfigParser`` object or ``None`` (the default).
+``_stdin``, ``_stdout``, ``_stderr``
+  The streams the command should read from and write to.  These are
+  the ``sys`` streams unless the command was run via
+  ``Dispatcher.run`` with other streams.
+``_resources``
+  A mapping of the instances of the resources named in the
+  command's ``resources`` attribute, keyed by name.
 
 In most circumstances, only the ``_args`` attribute will be
 required.  The others are mainly used in the implementations of
@@ -75,7 +99,18 @@ Dispatcher
 
 Commands are registered to a ``Dispatcher`` instance.  The command
 line parsing and dispatching is accomplished by calling the
-dispatcher's ``dispatch`` method, which takes no arguments.
+dispatcher's ``dispatch`` method, which takes no arguments.  A
+``UserWarning`` raised by a command is not propagated to the caller
+of ``dispatch``; its message is written to stderr as an error and
+the program exits with status 1.
+
+To run a command from within a program, call the dispatcher's
+``run`` method with a sequence of arguments and, optionally, the
+``stdin``, ``stdout`` and ``stderr`` streams to use.  It returns the
+exit status instead of calling ``sys.exit``, does not read
+``sys.argv``, and may be called repeatedly and concurrently.  As
+with ``dispatch``, a ``UserWarning`` raised by the command results
+in an error message on ``stderr`` and an exit status of 1.
 
 Global arguments (arguments to be applied to every command) are
 given as a sequence of command arguments (see above) to the
@@ -84,6 +119,30 @@ given as a sequence of command arguments (see above) to the
 A ``Config`` object may also be given via the ``config`` keyword
 argument.
 
+A dispatcher created with ``with_profile=True`` reserves the global
+option ``--profile[=PATH]``, which must precede the command name.  It
+runs the command under ``cProfile``, writes the profile to ``PATH``
+in pstats format and to ``PATH.folded`` as collapsed stacks for
+flamegraph tools, and writes a summary of the most expensive
+functions to stderr.  By default only the construction and calling
+of the command are profiled; pass ``profile_dispatch=True`` to
+include argument parsing and the rest of the dispatcher.  The
+targets of a fan-out command are profiled on their own threads and
+included in the output as separate stacks.
+
+Resources that are expensive to create, such as database connections,
+may be registered with the dispatcher's ``add_resource`` method,
+which takes a name, a ``setup`` callable and an optional ``teardown``
+callable.  A command that lists the name in its ``resources``
+attribute receives an instance in its ``_resources`` mapping.
+Instances are created when first needed and are pooled and reused by
+later commands; a command has exclusive use of its instances while it
+runs, but the targets of a fan-out command share them.  If a fan-out
+target times out, the command's instances are dropped from the pool
+without being torn down, since the target may still be using them.
+Calling the dispatcher's ``close`` method (or leaving a ``with``
+block on the dispatcher) tears the instances down.
+
 
 Config
 ======
@@ -97,6 +156,21 @@ The following methods are required to be implemented by subclasses:
   Given a section name (the only argument), return the input
   if the section is valid, otherwise raise ``UserWarning``.
 
+If the path given to a ``Config`` is a directory, each section is
+stored in its own file in that directory, named after the
+(URL-quoted) section name with an ``.ini`` extension; the defaults
+are stored in ``DEFAULT.ini``.  Sections are parsed when first
+accessed, and ``write`` rewrites only the files of sections that have
+changed.
+
+A ``Config`` subclass that sets the ``journal`` attribute to ``True``
+appends each change to a journal file (the configuration path with
+a ``.journal`` suffix) on ``write``, instead of rewriting the
+configuration.  The journal is replayed when the configuration is
+read.  Once it grows beyond ``journal_limit`` bytes, ``write`` folds
+it back into the configuration; ``compact`` may also be called
+directly.
+
 
 Caveats and limitations
 =======================
@@ -129,7 +203,7 @@ doing arithmetic in bases other than 10 (e.g. binary)::
             else:
                 mapper = lambda x: int(x)
             inputs = (mapper(x) for x in self._args.inputs)
-            print reduce(self._reduce, inputs)
+            print >>self._stdout, reduce(self._reduce, inputs)
 
 
     class Add(CalculatorCommand):
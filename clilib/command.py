@@ -20,7 +20,14 @@ CLI command classes.
 """
 
 import argparse
+import copy
+import cProfile
+import Queue
+import StringIO
+import sys
 import textwrap
+import threading
+import time
 
 from . import util
 
@@ -29,6 +36,7 @@ class Command(object):
     """A command object.
 
     Subclasses must implement ``__call__``, which takes no arguments.
+    It may return an exit status; ``None`` is treated as 0.
 
     The short help is the first non-empty paragraph of the docstring
     of the command, and the epilog is the whole docstring excluding
@@ -41,6 +49,51 @@ class Command(object):
     ArgumentParser.add_argument().
     """
 
+    resources = ()
+    """
+    Names of dispatcher resources the command requires.  An instance
+    of each is given to the command in the ``_resources`` mapping.
+    """
+
+    fanout = None
+    """
+    The ``dest`` of the argument whose values are fan-out targets, or
+    ``None``.
+
+    When set, ``__call__`` takes a single target as its argument and
+    is called once per target on a pool of threads.  A value of ``-``
+    reads targets from stdin and ``@path`` reads them from a file, one
+    per line.  Output from each target is buffered and written when
+    that target finishes.  The exit status is the greatest status
+    returned by any target; a target that raises ``UserWarning`` or
+    times out has status 1.
+    """
+
+    fanout_workers = 4
+    """Maximum number of targets to run concurrently."""
+
+    fanout_timeout = None
+    """
+    Seconds to allow each target once it has started, or ``None``.
+
+    A target that takes longer is reported as timed out.  Its thread
+    cannot be interrupted, so it is abandoned and another thread takes
+    its place in the pool.
+    """
+
+    fanout_ordered = True
+    """Write output in target order rather than as targets complete."""
+
+    _abandoned = False
+    """Set by fan-out when a timed out target may still be running."""
+
+    _profilers = None
+    """
+    When profiling, a list to which a profiler for each fan-out target
+    is added (targets run on other threads, which are not otherwise
+    profiled).
+    """
+
     @classmethod
     def add_parser(cls, subparsers):
         """Add a subparser for this command to a subparsers object."""
@@ -65,7 +118,18 @@ class Command(object):
             textwrap.dedent(cls.__doc__).split('\n\n')[1:]
         ).strip()
 
-    def __init__(self, args, parser, commands, aliases, config=None):
+    def __init__(
+        self,
+        args,
+        parser,
+        commands,
+        aliases,
+        config=None,
+        stdin=None,
+        stdout=None,
+        stderr=None,
+        resources=None,
+    ):
         """
         Initialse the command.
 
@@ -79,12 +143,174 @@ class Command(object):
             a dict of aliases keyed by alias
         ``config``
             a ``ConfigParser.SafeConfigParser`` or ``None`` (the default)
+        ``stdin``, ``stdout``, ``stderr``
+            file-like objects the command should use for input and
+            output; default to the ``sys`` streams
+        ``resources``
+            a dict of resource instances keyed by name
         """
         self._args = args
         self._parser = parser
         self._commands = commands
         self._aliases = aliases
         self._config = config
+        self._stdin = stdin or sys.stdin
+        self._stdout = stdout or sys.stdout
+        self._stderr = stderr or sys.stderr
+        self._resources = resources or {}
+
+    def _invoke(self):
+        """Call the command, fanning out if required; return exit status."""
+        if self.fanout is None:
+            return self() or 0
+        return self._fan_out()
+
+    def _targets(self):
+        """Generate the fan-out targets, expanding ``-`` and ``@path``."""
+        values = getattr(self._args, self.fanout)
+        if values is None:
+            values = []
+        elif isinstance(values, basestring):
+            values = [values]
+        for value in values:
+            if value == '-':
+                lines = self._stdin
+            elif value.startswith('@'):
+                try:
+                    with open(value[1:]) as fh:
+                        lines = fh.readlines()
+                except IOError as e:
+                    raise UserWarning(
+                        'Cannot read targets from {}: {}'.format(
+                            value[1:], e.strerror))
+            else:
+                yield value
+                continue
+            for line in lines:
+                line = line.strip()
+                if line:
+                    yield line
+
+    def _call_target(self, target):
+        """Call a copy of the command on one target with buffered output.
+
+        Return a tuple of the status, stdout and stderr.
+        """
+        cmd = copy.copy(self)
+        cmd._stdout = StringIO.StringIO()
+        cmd._stderr = StringIO.StringIO()
+        try:
+            if self._profilers is None:
+                status = cmd(target) or 0
+            else:
+                profiler = cProfile.Profile()
+                self._profilers.append(profiler)
+                status = profiler.runcall(cmd, target) or 0
+        except UserWarning as e:
+            print >>cmd._stderr, '{}: {}'.format(target, e)
+            status = 1
+        return status, cmd._stdout.getvalue(), cmd._stderr.getvalue()
+
+    def _fan_out(self):
+        """Call the command on each target; return the combined status."""
+        targets = list(self._targets())
+        if not targets:
+            return 0
+        todo = Queue.Queue()
+        for i in range(len(targets)):
+            todo.put(i)
+        done = Queue.Queue()
+        lock = threading.Lock()
+        started = {}
+        abandoned = set()
+        errors = []
+        stop = threading.Event()
+
+        def work():
+            while not stop.is_set():
+                try:
+                    i = todo.get_nowait()
+                except Queue.Empty:
+                    return
+                with lock:
+                    started[i] = time.time()
+                try:
+                    done.put((i, self._call_target(targets[i])))
+                except Exception:
+                    with lock:
+                        # errors from abandoned targets are ignored;
+                        # otherwise start no further targets
+                        if i not in abandoned:
+                            errors.append(sys.exc_info())
+                            stop.set()
+                    done.put((i, None))
+                with lock:
+                    if i in abandoned:
+                        # i timed out and another worker took our place
+                        return
+
+        def start_worker():
+            thread = threading.Thread(target=work)
+            thread.daemon = True
+            thread.start()
+
+        for _ in range(min(self.fanout_workers, len(targets))):
+            start_worker()
+        try:
+            pending = set(range(len(targets)))
+            results = {}
+            next_result = 0
+            status = 0
+            while pending or results:
+                # time out started targets and find the next deadline
+                wait = self.fanout_timeout
+                if wait is not None:
+                    now = time.time()
+                    with lock:
+                        for i in pending.intersection(started):
+                            remaining = started[i] + self.fanout_timeout - now
+                            if remaining > 0:
+                                wait = min(wait, remaining)
+                                continue
+                            # abandon the target and replace its worker
+                            pending.remove(i)
+                            abandoned.add(i)
+                            self._abandoned = True
+                            results[i] = (
+                                1, '', '{}: timed out\n'.format(targets[i]))
+                            start_worker()
+
+                # wait until a target finishes or the deadline passes
+                if pending:
+                    try:
+                        i, result = done.get(timeout=wait)
+                    except Queue.Empty:
+                        pass
+                    else:
+                        if errors:
+                            exc_info = errors[0]
+                            raise exc_info[0], exc_info[1], exc_info[2]
+                        if i in pending:
+                            pending.remove(i)
+                            results[i] = result
+
+                # write output that is ready
+                if self.fanout_ordered:
+                    ready = []
+                    while next_result in results:
+                        ready.append(next_result)
+                        next_result += 1
+                else:
+                    ready = sorted(results)
+                for i in ready:
+                    target_status, out, err = results.pop(i)
+                    self._stdout.write(out)
+                    self._stderr.write(err)
+                    status = max(status, target_status)
+            return status
+        finally:
+            # start no further targets; abandoned workers are daemonic
+            stop.set()
 
 
 class Config(Command):
@@ -111,7 +337,8 @@ class Config(Command):
         if args.list:
             for section in self._config.sections():
                 for option, value in self._config.items(section):
-                    print '{}={}'.format('.'.join((section, option)), value)
+                    print >>self._stdout, '{}={}'.format(
+                        '.'.join((section, option)), value)
         elif not args.name:
             raise UserWarning('No configuration option given.')
         else:
@@ -136,10 +363,11 @@ class Config(Command):
                     if self._config.has_option(section, option) else None
                 self._config.set(section, option, args.value)
                 self._config.write()
-                print '{}: {} => {}'.format(args.name, oldvalue, args.value)
+                print >>self._stdout, '{}: {} => {}'.format(
+                    args.name, oldvalue, args.value)
             else:
                 curvalue = self._config.get(section, option)
-                print '{}: {}'.format(args.name, curvalue)
+                print >>self._stdout, '{}: {}'.format(args.name, curvalue)
 
 
 class Help(Command):
@@ -155,11 +383,12 @@ class Help(Command):
             self._parser.parse_args(['--help'])
         else:
             if self._args.subcommand in self._aliases:
-                print "'{}': alias for {}".format(
+                print >>self._stdout, "'{}': alias for {}".format(
                     self._args.subcommand,
                     self._aliases[self._args.subcommand]
                 )
             elif self._args.subcommand not in self._commands:
-                print "unknown subcommand: '{}'".format(self._args.subcommand)
+                print >>self._stdout, "unknown subcommand: '{}'".format(
+                    self._args.subcommand)
             else:
                 self._parser.parse_args([self._args.subcommand, '--help'])
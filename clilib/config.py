@@ -16,17 +16,135 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import ConfigParser
+import contextlib
+import json
 import os.path
 import re
+import shutil
+import urllib
+import UserDict
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 
 class ConfigError(Exception):
     pass
 
 
+_JOURNAL_OPS = ('add_section', 'set', 'remove_option', 'remove_section')
+
+
+def _checksum(record):
+    return '{:08x}'.format(zlib.crc32(record) & 0xffffffff)
+
+
+def _journal_record(op):
+    """Serialise a journal operation.
+
+    Strings are stored as bytes (unicode is UTF-8 encoded first) and
+    decoded as latin-1, so that any byte string survives the round
+    trip through JSON.
+    """
+    return json.dumps(
+        [x.encode('utf-8') if isinstance(x, unicode) else x for x in op],
+        encoding='latin-1'
+    )
+
+
+def _complete_length(fp):
+    """Return the length of the complete lines at the start of ``fp``."""
+    fp.seek(0, os.SEEK_END)
+    end = fp.tell()
+    if not end:
+        return 0
+    fp.seek(end - 1)
+    if fp.read(1) == '\n':
+        return end
+    while end > 0:
+        start = max(0, end - 4096)
+        fp.seek(start)
+        i = fp.read(end - start).rfind('\n')
+        if i >= 0:
+            return start + i + 1
+        end = start
+    return 0
+
+
+class _ShardedSections(UserDict.DictMixin):
+    """Mapping of section names to option dicts, loaded on first access.
+
+    ``load`` is called with the section name to read the section.
+    """
+
+    def __init__(self, names, load):
+        self._names = list(names)
+        self._known = set(self._names)
+        self._loaded = {}
+        self._load = load
+
+    def __getitem__(self, key):
+        if key not in self._loaded:
+            if key not in self._known:
+                raise KeyError(key)
+            self._loaded[key] = self._load(key)
+        return self._loaded[key]
+
+    def __setitem__(self, key, value):
+        if key not in self._known:
+            self._names.append(key)
+            self._known.add(key)
+        self._loaded[key] = value
+
+    def __delitem__(self, key):
+        if key not in self._known:
+            raise KeyError(key)
+        self._names.remove(key)
+        self._known.remove(key)
+        self._loaded.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._known
+
+    def __iter__(self):
+        return iter(list(self._names))
+
+    def keys(self):
+        return list(self._names)
+
+
 class Config(ConfigParser.SafeConfigParser):
+    """Configuration file.
+
+    If ``path`` is a directory, the sharded layout is used: each
+    section is stored in its own file in the directory, named after
+    the (URL-quoted) section name with an ``.ini`` extension.  Only
+    the names of sections are read initially; a section is parsed
+    when first accessed, and ``write`` rewrites only the sections
+    that have been changed.
+
+    If ``journal`` is true, ``write`` appends the changes made since
+    the last write to a journal file alongside the configuration (its
+    path with a ``.journal`` suffix) instead of rewriting it.  The
+    journal is replayed when the configuration is read, and is folded
+    back into the configuration by ``compact`` once it has grown
+    beyond ``journal_limit`` bytes.  A record that was only partly
+    written, e.g. due to a crash, is ignored.  The journal is locked
+    while it is read, appended to or compacted, so several processes
+    may update the configuration.  Journaling requires ``fcntl``.
+    """
+
     _instances = {}
 
+    shard_ext = '.ini'
+
+    journal = False
+
+    journal_limit = 64 * 1024
+
     @classmethod
     def get_config(cls, path):
         path = os.path.expanduser(path)
@@ -38,14 +156,207 @@ class Config(ConfigParser.SafeConfigParser):
         path = os.path.expanduser(path)
         ConfigParser.SafeConfigParser.__init__(self)
         self._path = path
-        self.read(self._path)
+        self._dirty = set()
+        self._pending = []
+        self._replaying = False
+        if not self.journal:
+            self._load(None)
+            return
+        if fcntl is None:
+            raise ConfigError('Journaled configuration requires fcntl.')
+        try:
+            fp = open(self._journal_path(), 'rb')
+        except IOError:
+            self._load(None)
+        else:
+            with fp:
+                fcntl.flock(fp, fcntl.LOCK_SH)
+                self._load(fp)
+
+    def _load(self, journal):
+        """Read the configuration, replaying the ``journal`` file if given.
+
+        Any previously read state is discarded.
+        """
+        self._sections = self._dict()
+        self._defaults = self._dict()
+        self._dirty.clear()
+        if os.path.isdir(self._path):
+            names = sorted(
+                urllib.unquote(name[:-len(self.shard_ext)])
+                for name in os.listdir(self._path)
+                if name.endswith(self.shard_ext)
+            )
+            if ConfigParser.DEFAULTSECT in names:
+                names.remove(ConfigParser.DEFAULTSECT)
+                self._defaults = self._read_shard(ConfigParser.DEFAULTSECT)
+            self._sections = _ShardedSections(names, self._read_shard)
+        else:
+            self.read(self._path)
+        if journal:
+            self._replay_journal(journal)
+
+    def is_sharded(self):
+        """Whether the sharded (directory) layout is in use."""
+        return isinstance(self._sections, _ShardedSections)
+
+    def _shard_path(self, section):
+        return os.path.join(
+            self._path, urllib.quote(section, safe='') + self.shard_ext)
+
+    def _read_shard(self, section):
+        """Read and return the options of a section from its file."""
+        parser = ConfigParser.RawConfigParser(dict_type=self._dict)
+        parser.optionxform = self.optionxform
+        path = self._shard_path(section)
+        with open(path) as fp:
+            parser.readfp(fp, path)
+        if section == ConfigParser.DEFAULTSECT:
+            return parser._defaults
+        if not parser.has_section(section):
+            raise ConfigError(
+                '{} does not contain section {!r}'.format(path, section))
+        return parser._sections[section]
+
+    def _write_shard(self, section):
+        """Write a section to its file, or remove the file if empty."""
+        path = self._shard_path(section)
+        parser = ConfigParser.RawConfigParser(dict_type=self._dict)
+        if section == ConfigParser.DEFAULTSECT:
+            parser._defaults = self._defaults
+        elif section in self._sections:
+            parser._sections[section] = self._sections[section]
+        if not (parser._defaults or parser._sections):
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        with open(path + '.tmp', 'w') as fp:
+            parser.write(fp)
+        os.rename(path + '.tmp', path)
+
+    def _journal_path(self):
+        return self._path.rstrip(os.sep) + '.journal'
+
+    @contextlib.contextmanager
+    def _locked_journal(self):
+        """Open the journal for appending and lock it exclusively."""
+        with open(self._journal_path(), 'ab+') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            yield fp
+
+    def _replay_journal(self, fp):
+        """Apply the complete, intact records in the journal."""
+        fp.seek(0)
+        lines = fp.read().split('\n')[:-1]
+        self._replaying = True
+        try:
+            for line in lines:
+                checksum, _, record = line.partition(' ')
+                if checksum != _checksum(record):
+                    continue
+                op = [
+                    x.encode('latin-1') if isinstance(x, unicode) else x
+                    for x in json.loads(record)
+                ]
+                if op[0] not in _JOURNAL_OPS:
+                    continue
+                try:
+                    getattr(self, op[0])(*op[1:])
+                except (ConfigParser.Error, UserWarning):
+                    # already applied, e.g. before an interrupted compaction
+                    pass
+        finally:
+            self._replaying = False
+
+    def _append_journal(self, fp):
+        """Append the pending changes to the locked journal ``fp``.
+
+        Return the new size of the journal.
+        """
+        pending, self._pending = self._pending, []
+        data = ''.join(
+            '{} {}\n'.format(_checksum(record), record)
+            for record in (_journal_record(op) for op in pending)
+        )
+
+        # discard a partly written record left by a crash
+        end = _complete_length(fp)
+        fp.truncate(end)
+        fp.write(data)
+        fp.flush()
+        os.fsync(fp.fileno())
+        return fp.tell()
+
+    def _write(self, atomic=False):
+        """Write changed sections or the whole file.
+
+        If ``atomic``, the file is written to a temporary file which
+        then replaces the (symlink-resolved) original, keeping its
+        mode.
+        """
+        if self.is_sharded():
+            for section in sorted(self._dirty):
+                self._write_shard(section)
+        elif atomic:
+            path = os.path.realpath(self._path)
+            with open(path + '.tmp', 'w') as fp:
+                ConfigParser.SafeConfigParser.write(self, fp)
+            if os.path.exists(path):
+                shutil.copymode(path, path + '.tmp')
+            os.rename(path + '.tmp', path)
+        else:
+            with open(self._path, 'w') as fp:
+                ConfigParser.SafeConfigParser.write(self, fp)
+        self._dirty.clear()
 
     def write(self):
-        with open(self._path, 'w') as fp:
-            ConfigParser.SafeConfigParser.write(self, fp)
+        if not self.journal:
+            self._write()
+            return
+        with self._locked_journal() as fp:
+            if self._append_journal(fp) > self.journal_limit:
+                self._compact(fp)
+
+    def compact(self):
+        """Write the configuration and empty the journal."""
+        with self._locked_journal() as fp:
+            self._append_journal(fp)
+            self._compact(fp)
+
+    def _compact(self, fp):
+        """Fold the locked journal ``fp`` into the configuration."""
+        # re-read, to include changes journaled by other writers
+        self._load(fp)
+        self._write(atomic=True)
+        fp.truncate(0)
+        fp.flush()
+        os.fsync(fp.fileno())
+
+    def _touch(self, section, *op):
+        """Record that a section has changed."""
+        self._dirty.add(section or ConfigParser.DEFAULTSECT)
+        if self.journal and not self._replaying:
+            self._pending.append(op)
 
     def add_section(self, section):
         """Checks that the given section is valid, then adds it."""
-        ConfigParser.SafeConfigParser.add_section(
-            self, self.check_section(section)
-        )
+        section = self.check_section(section)
+        ConfigParser.SafeConfigParser.add_section(self, section)
+        self._touch(section, 'add_section', section)
+
+    def set(self, section, option, value=None):
+        ConfigParser.SafeConfigParser.set(self, section, option, value)
+        self._touch(section, 'set', section, option, value)
+
+    def remove_option(self, section, option):
+        existed = ConfigParser.SafeConfigParser.remove_option(
+            self, section, option)
+        if existed:
+            self._touch(section, 'remove_option', section, option)
+        return existed
+
+    def remove_section(self, section):
+        existed = ConfigParser.SafeConfigParser.remove_section(self, section)
+        if existed:
+            self._touch(section, 'remove_section', section)
+        return existed
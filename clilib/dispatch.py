@@ -17,14 +17,47 @@
 
 
 import argparse
+import cProfile
+import sys
+import threading
 
 from . import command
+from . import profiling
+from . import resources
 from . import util
 
 
+class _ProfileAction(argparse.Action):
+    """Action for the reserved ``--profile`` option.
+
+    ``--profile`` is removed from the arguments before they are
+    parsed, so the parser only sees it after the command name.  The
+    argument exists so that it is listed in the help.
+    """
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        parser.error('{} must precede the command'.format(option_string))
+
+
+def _add_profile_arg(parser):
+    parser.add_argument(
+        '--profile', nargs='?', metavar='PATH', action=_ProfileAction,
+        default=argparse.SUPPRESS,
+        help='profile the command, writing the profile to PATH '
+             '(default: {})'.format(profiling.DEFAULT_PATH)
+    )
+
+
 class Dispatcher(object):
     """Dispatcher class."""
-    __slots__ = ['_commands', '_config', '_global_args']
+    __slots__ = [
+        '_commands', '_config', '_global_args',
+        '_lock', '_parsers', '_profile', '_profile_dispatch',
+        '_resources', '_streams',
+    ]
+
+    profile_limit = 20
+    """Number of functions shown in the ``--profile`` summary."""
 
     def __init__(
         self,
@@ -32,6 +65,8 @@ class Dispatcher(object):
         global_args=(),
         with_help=True,
         with_config=False,
+        with_profile=False,
+        profile_dispatch=False,
     ):
         """Initialise the dispatcher.
 
@@ -46,10 +81,33 @@ class Dispatcher(object):
         ``with_config``
           Whether to provide the built-in "config" command.
           Defaults to ``False``.
+        ``with_profile``
+          Whether to provide the ``--profile[=PATH]`` global option,
+          which profiles the command.  Defaults to ``False``.
+        ``profile_dispatch``
+          Whether ``--profile`` also profiles argument parsing and
+          the rest of the dispatcher.  Defaults to ``False``.
+
+        ``ValueError`` is raised if ``with_profile`` is true and
+        ``global_args`` defines ``--profile``.
         """
         self._config = config
         self._global_args = global_args
         self._commands = set()
+        self._lock = threading.Lock()
+        self._parsers = None
+        self._profile = with_profile
+        self._profile_dispatch = profile_dispatch
+        self._resources = {}
+        self._streams = threading.local()
+
+        if with_profile:
+            parser = argparse.ArgumentParser(add_help=False)
+            for arg in global_args:
+                util.add_arg_to_parser(arg, parser)
+            if '--profile' in parser._option_string_actions:
+                raise ValueError(
+                    'global argument --profile is reserved by with_profile')
 
         if with_help:
             self.add_command(command.Help)
@@ -62,7 +120,41 @@ class Dispatcher(object):
             raise TypeError(
                 '{} is not an instance of {}'.format(cmd, command.Command)
             )
-        self._commands.add(cmd)
+        with self._lock:
+            self._commands.add(cmd)
+            self._parsers = None
+
+    def add_resource(self, name, setup, teardown=None):
+        """Register a resource that commands may ask for by ``name``.
+
+        ``setup`` is called with no arguments to create an instance
+        the first time one is needed.  Instances are pooled and given
+        to later commands; one instance is used by at most one
+        command at a time.  ``teardown``, if given, is called with
+        each instance when the dispatcher is closed.  The instances
+        of a fan-out command with a timed out target are dropped from
+        the pool without teardown, as the target may still be running.
+        """
+        with self._lock:
+            if name in self._resources:
+                raise ValueError('resource {!r} already added'.format(name))
+            self._resources[name] = resources.ResourcePool(setup, teardown)
+
+    def close(self):
+        """Tear down all resource instances.
+
+        Call this when no commands are running, e.g. at shutdown.
+        The dispatcher may also be used as a context manager, which
+        calls ``close`` on exit.
+        """
+        for pool in self._resources.values():
+            pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def aliases(self):
         return dict(self._config.items('alias')) \
@@ -76,48 +168,183 @@ class Dispatcher(object):
         ]
         return 'user-defined aliases:\n' + '\n'.join(lines) if lines else None
 
-    def dispatch(self):
-        # create an argument parser
-        parser_1 = argparse.ArgumentParser(add_help=False)
-
-        # add global arguments
-        for arg in self._global_args:
-            util.add_arg_to_parser(arg, parser_1)
-
-        # parse known args
-        args, argv = parser_1.parse_known_args()
-
-        # add subcommands
-        parser_2 = argparse.ArgumentParser(
-            parents=[parser_1],
-            description='Perform evidence based scheduling.',
-            epilog=self.epilog(),
-            formatter_class=argparse.RawDescriptionHelpFormatter
-        )
-        subparsers = parser_2.add_subparsers(title='subcommands')
-        commands = {x.__name__.lower(): x for x in self._commands}
-        for name in sorted(commands):
-            commands[name].add_parser(subparsers)
-
-        # process user-defined aliases
+    def _build_parsers(self, aliases):
+        """Return the global parser, command parser and command mapping.
+
+        The parsers are built once and reused until a command is added
+        or the aliases change.
+        """
+        key = sorted(aliases.viewitems())
+        with self._lock:
+            if self._parsers is None or self._parsers[0] != key:
+                # create an argument parser
+                parser_1 = util.ArgumentParser(
+                    add_help=False, streams=self._streams)
+
+                # add global arguments
+                if self._profile:
+                    _add_profile_arg(parser_1)
+                for arg in self._global_args:
+                    util.add_arg_to_parser(arg, parser_1)
+
+                # add subcommands
+                parser_2 = util.ArgumentParser(
+                    parents=[parser_1],
+                    description='Perform evidence based scheduling.',
+                    epilog=self.epilog(),
+                    formatter_class=argparse.RawDescriptionHelpFormatter,
+                    streams=self._streams
+                )
+                subparsers = parser_2.add_subparsers(title='subcommands')
+                commands = {x.__name__.lower(): x for x in self._commands}
+                for name in sorted(commands):
+                    commands[name].add_parser(subparsers)
+
+                self._parsers = key, parser_1, parser_2, commands
+            return self._parsers[1:]
+
+    def run(self, argv, stdin=None, stdout=None, stderr=None):
+        """Parse ``argv`` and run the selected command.
+
+        ``argv``
+          Sequence of arguments, not including the program name.
+        ``stdin``, ``stdout``, ``stderr``
+          File-like objects given to the command and used for help
+          and error output.  Default to the ``sys`` streams.
+
+        Return the exit status.  ``SystemExit`` is never raised and
+        no interpreter-wide state is modified, so ``run`` may be
+        called repeatedly and from several threads at once.
+
+        If the dispatcher was created ``with_profile``, a
+        ``--profile[=PATH]`` argument given before the command name
+        causes the command to be run under ``cProfile``.  The profile
+        is written to ``PATH`` (``profiling.DEFAULT_PATH`` by default)
+        in pstats format and to ``PATH.folded`` as collapsed stacks for
+        flamegraph tools, and a summary is written to ``stderr``.
+        """
+        argv = list(argv)
+        path = self._profile_option(argv) if self._profile else None
+        if path is None:
+            return self._run(argv, stdin, stdout, stderr, None)
+
+        # the first profiler is the dispatcher's; fan-out targets add more
+        profilers = [cProfile.Profile()]
+        if self._profile_dispatch:
+            profilers[0].enable()
+        try:
+            status = self._run(argv, stdin, stdout, stderr, profilers)
+        finally:
+            profilers[0].disable()
+            written = profiling.report(
+                profilers, path, stderr or sys.stderr, self.profile_limit)
+        # failing to write the profile fails an otherwise successful run
+        return status if written else status or 1
+
+    def _profile_option(self, argv):
+        """Remove ``--profile`` options preceding the command from argv.
+
+        Return the profile path, or ``None`` if not profiling.
+        """
+        path = None
+        names = set(self.aliases())
+        names.update(x.__name__.lower() for x in self._commands)
+        i = 0
+        while i < len(argv) and argv[i] != '--' and argv[i] not in names:
+            if argv[i] == '--profile':
+                path = profiling.DEFAULT_PATH
+            elif argv[i].startswith('--profile='):
+                path = argv[i].split('=', 1)[1] or profiling.DEFAULT_PATH
+            else:
+                i += 1
+                continue
+            del argv[i]
+        return path
+
+    def _run(self, argv, stdin, stdout, stderr, profilers):
+        """Run the command, profiling it if ``profilers`` is given.
+
+        Unless the whole dispatcher is being profiled, the first of
+        ``profilers`` is enabled while the command is constructed and
+        called.  Profilers of fan-out targets are appended to the list.
+        """
+        profiler = None
+        if profilers and not self._profile_dispatch:
+            profiler = profilers[0]
+        stdin = stdin or sys.stdin
+        stdout = stdout or sys.stdout
+        stderr = stderr or sys.stderr
         aliases = self.aliases()
-        for i, arg in enumerate(argv):
-            if arg in aliases:
-                # an alias; replace and stop processing
-                argv[i:i + 1] = aliases[arg].split()
-                break
-            if arg in commands:
-                # a valid command; stop processing
-                break
-
-        # parse remaining args
-        args = parser_2.parse_args(args=argv, namespace=args)
-
-        # execute command
-        args.command(
-            args=args,
-            parser=parser_2,
-            commands=commands,
-            aliases=aliases,
-            config=self._config
-        )()
+        parser_1, parser_2, commands = self._build_parsers(aliases)
+
+        # route parser output; save the outer streams for re-entrant calls
+        saved = self._streams.__dict__.copy()
+        self._streams.stdout = stdout
+        self._streams.stderr = stderr
+        acquired = {}
+        cmd = None
+        try:
+            # parse known args
+            args, argv = parser_1.parse_known_args(argv)
+
+            # process user-defined aliases
+            for i, arg in enumerate(argv):
+                if arg in aliases:
+                    # an alias; replace and stop processing
+                    argv[i:i + 1] = aliases[arg].split()
+                    break
+                if arg in commands:
+                    # a valid command; stop processing
+                    break
+
+            # parse remaining args
+            args = parser_2.parse_args(args=argv, namespace=args)
+
+            # acquire resources and execute command
+            for name in args.command.resources:
+                if name not in self._resources:
+                    raise KeyError('no such resource: {!r}'.format(name))
+                acquired[name] = self._resources[name].acquire()
+            if profiler:
+                profiler.enable()
+            try:
+                cmd = args.command(
+                    args=args,
+                    parser=parser_2,
+                    commands=commands,
+                    aliases=aliases,
+                    config=self._config,
+                    stdin=stdin,
+                    stdout=stdout,
+                    stderr=stderr,
+                    resources=acquired
+                )
+                cmd._profilers = profilers
+                return cmd._invoke()
+            finally:
+                if profiler:
+                    profiler.disable()
+        except util.ParserExit as e:
+            return e.status
+        except UserWarning as e:
+            stderr.write('{}: error: {}\n'.format(parser_2.prog, e))
+            return 1
+        finally:
+            for name, instance in acquired.viewitems():
+                if cmd and cmd._abandoned:
+                    # a timed out fan-out target may still be using it
+                    self._resources[name].discard(instance)
+                else:
+                    self._resources[name].release(instance)
+            self._streams.__dict__.clear()
+            self._streams.__dict__.update(saved)
+
+    def dispatch(self):
+        """Run the command given by ``sys.argv``, exiting on failure.
+
+        A ``UserWarning`` raised by the command is reported on stderr
+        and results in exit status 1, rather than being propagated.
+        """
+        status = self.run(sys.argv[1:])
+        if status:
+            sys.exit(status)
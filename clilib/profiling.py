@@ -0,0 +1,103 @@
+# This file is part of clilib
+# Copyright (C) 2012 Fraser Tweedale
+#
+# clilib is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Profiling support.
+"""
+
+import collections
+import os.path
+import pstats
+
+
+DEFAULT_PATH = 'clilib.pstats'
+
+
+def label(func):
+    """Return a flamegraph frame label for a pstats function key."""
+    filename, lineno, name = func
+    if filename == '~':
+        text = name
+    else:
+        text = '{}:{}:{}'.format(os.path.basename(filename), lineno, name)
+    return text.replace(';', ':')
+
+
+def collapse(stats):
+    """Return collapsed stacks for a ``pstats.Stats``.
+
+    The result maps semicolon-separated stacks to microseconds of own
+    time.  cProfile records only caller-callee pairs, so the time of
+    a function is split between its callers in proportion to the time
+    spent in it on behalf of each.  Recursive calls are folded into
+    the outermost frame.
+    """
+    callees = collections.defaultdict(dict)
+    for func, (cc, nc, tt, ct, callers) in stats.stats.viewitems():
+        for caller, info in callers.viewitems():
+            callees[caller][func] = info[3]
+    roots = [
+        func for func, value in stats.stats.viewitems()
+        if not any(caller in stats.stats for caller in value[4])
+    ]
+
+    counts = collections.Counter()
+    todo = [(func, (), 1.0) for func in roots]
+    while todo:
+        func, stack, scale = todo.pop()
+        tt = stats.stats[func][2]
+        stack += (func,)
+        own = int(tt * scale * 1e6)
+        if own:
+            counts[';'.join(label(x) for x in stack)] += own
+        for callee, ct in callees[func].viewitems():
+            total = stats.stats[callee][3]
+            if callee in stack or not total or ct * scale < 1e-6:
+                continue
+            todo.append((callee, stack, scale * ct / total))
+    return counts
+
+
+def report(profilers, path, stream, limit=20):
+    """Write profile output and a summary.
+
+    The combined statistics of ``profilers`` (``cProfile.Profile``
+    objects) are saved in pstats format to ``path``, and collapsed
+    stacks are written to ``path`` with a ``.folded`` suffix.  The
+    ``limit`` functions with the greatest cumulative time are written
+    to ``stream``.  If nothing was profiled (e.g. the arguments could
+    not be parsed), no files are written.
+
+    Return ``False`` if the profile could not be written (the error
+    is reported on ``stream``), otherwise ``True``.
+    """
+    profilers = [x for x in profilers if x.getstats()]
+    if not profilers:
+        print >>stream, 'no profile data collected'
+        return True
+    stats = pstats.Stats(*profilers, stream=stream)
+    try:
+        stats.dump_stats(path)
+        with open(path + '.folded', 'w') as fh:
+            for stack, count in sorted(collapse(stats).viewitems()):
+                fh.write('{} {}\n'.format(stack, count))
+    except EnvironmentError as e:
+        print >>stream, 'cannot write profile to {}: {}'.format(
+            path, e.strerror or e)
+        return False
+    print >>stream, 'profile written to {0} and {0}.folded'.format(path)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return True
@@ -0,0 +1,81 @@
+# This file is part of clilib
+# Copyright (C) 2012 Fraser Tweedale
+#
+# clilib is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Shared resources for commands.
+"""
+
+import threading
+
+
+class ResourcePool(object):
+    """A pool of instances of a resource.
+
+    Instances are created by calling ``setup`` (with no arguments)
+    when one is acquired and none is idle, and are reused once
+    released.  ``teardown``, if given, is called with each instance
+    when the pool is closed.
+    """
+
+    def __init__(self, setup, teardown=None):
+        self._setup = setup
+        self._teardown = teardown
+        self._lock = threading.Lock()
+        self._idle = []
+        self._instances = []
+
+    def acquire(self):
+        """Return an idle instance, creating one if necessary."""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        instance = self._setup()
+        with self._lock:
+            self._instances.append(instance)
+        return instance
+
+    def release(self, instance):
+        """Return an acquired instance to the pool.
+
+        An instance that was torn down by ``close`` while acquired is
+        dropped rather than reused.
+        """
+        with self._lock:
+            if any(x is instance for x in self._instances):
+                self._idle.append(instance)
+
+    def discard(self, instance):
+        """Remove an acquired instance from the pool without teardown.
+
+        Use this for an instance that may still be in use elsewhere
+        and so must neither be reused nor torn down.
+        """
+        with self._lock:
+            self._instances = [x for x in self._instances if x is not instance]
+
+    def close(self):
+        """Tear down all instances.
+
+        The pool may be used again afterwards; new instances will be
+        created as required.
+        """
+        with self._lock:
+            instances = self._instances
+            self._instances = []
+            self._idle = []
+        if self._teardown:
+            for instance in instances:
+                self._teardown(instance)
@@ -14,6 +14,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import argparse
+import os
+import StringIO
+import tempfile
+import threading
+import time
 import unittest
 
 from . import command
@@ -68,3 +74,148 @@ class CommandTestCase(unittest.TestCase):
         instance = Bogo('fake', 'fake', 'fake', 'fake')
         self.assertEqual(instance.help(), "Newline.")
         self.assertEqual(instance.epilog(), "Second para.\n\nThird para.")
+
+
+class FanoutTestCase(unittest.TestCase):
+    """Test fan-out over command targets."""
+
+    class Ping(command.Command):
+        """Ping hosts."""
+        fanout = 'hosts'
+
+        def __call__(self, target):
+            if target == 'bad':
+                raise UserWarning('unreachable')
+            if target == 'slow':
+                time.sleep(0.5)
+            print >>self._stdout, 'pong', target
+            return 3 if target == 'three' else None
+
+    def invoke(self, hosts, stdin='', **attrs):
+        cls = type('Ping', (self.Ping,), attrs)
+        stdout, stderr = StringIO.StringIO(), StringIO.StringIO()
+        cmd = cls(
+            argparse.Namespace(hosts=hosts), 'fake', 'fake', 'fake',
+            stdin=StringIO.StringIO(stdin), stdout=stdout, stderr=stderr
+        )
+        status = cmd._invoke()
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def test_ordered(self):
+        hosts = [str(i) for i in range(20)]
+        status, out, err = self.invoke(hosts)
+        self.assertEqual(status, 0)
+        self.assertEqual(out, ''.join('pong {}\n'.format(x) for x in hosts))
+
+    def test_as_completed(self):
+        status, out, err = self.invoke(
+            ['slow', 'a'], fanout_ordered=False, fanout_workers=2)
+        self.assertEqual(out, 'pong a\npong slow\n')
+
+    def test_status(self):
+        status, out, err = self.invoke(['a', 'bad', 'three'])
+        self.assertEqual(status, 3)
+        self.assertEqual(out, 'pong a\npong three\n')
+        self.assertEqual(err, 'bad: unreachable\n')
+
+    def test_timeout(self):
+        status, out, err = self.invoke(['slow', 'a'], fanout_timeout=0.1)
+        self.assertEqual(status, 1)
+        self.assertEqual(out, 'pong a\n')
+        self.assertEqual(err, 'slow: timed out\n')
+
+    def test_timeout_more_targets_than_workers(self):
+        """A target outliving the timeout does not hold up the others."""
+        release = threading.Event()
+
+        class Hang(self.Ping):
+            def __call__(self, target):
+                if target == 'hang':
+                    release.wait(3)
+                return super(Hang, self).__call__(target)
+
+        stdout, stderr = StringIO.StringIO(), StringIO.StringIO()
+        cmd = Hang(
+            argparse.Namespace(hosts=['hang', 'a', 'b']), 'f', 'f', 'f',
+            stdout=stdout, stderr=stderr
+        )
+        cmd.fanout_workers = 1
+        cmd.fanout_timeout = 0.2
+        start = time.time()
+        try:
+            status = cmd._invoke()
+        finally:
+            release.set()
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(status, 1)
+        self.assertEqual(stdout.getvalue(), 'pong a\npong b\n')
+        self.assertEqual(stderr.getvalue(), 'hang: timed out\n')
+
+    def test_abandoned_target_error(self):
+        """An error from a timed out target does not stop the others."""
+        class Late(self.Ping):
+            fanout_workers = 1
+            fanout_timeout = 0.2
+
+            def __call__(self, target):
+                if target == 'hang':
+                    time.sleep(0.3)
+                    raise ValueError(target)
+                # still running when the abandoned target fails
+                time.sleep(0.1)
+                return super(Late, self).__call__(target)
+
+        stdout, stderr = StringIO.StringIO(), StringIO.StringIO()
+        cmd = Late(
+            argparse.Namespace(hosts=['hang', 'a', 'b', 'c', 'd']),
+            'f', 'f', 'f', stdout=stdout, stderr=stderr
+        )
+        start = time.time()
+        status = cmd._invoke()
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(status, 1)
+        self.assertEqual(
+            stdout.getvalue(), 'pong a\npong b\npong c\npong d\n')
+        self.assertEqual(stderr.getvalue(), 'hang: timed out\n')
+
+    def test_stdin_and_file(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                fh.write('c\n\nd\n')
+            status, out, err = self.invoke(
+                ['a', '-', '@' + path], stdin='b\n')
+        finally:
+            os.remove(path)
+        self.assertEqual(out, 'pong a\npong b\npong c\npong d\n')
+
+    def test_missing_file(self):
+        with self.assertRaises(UserWarning):
+            self.invoke(['@/nonexistent/targets'])
+
+    def test_exception_propagates(self):
+        class Broken(self.Ping):
+            def __call__(self, target):
+                raise ValueError(target)
+
+        cmd = Broken(argparse.Namespace(hosts=['x']), 'f', 'f', 'f')
+        with self.assertRaises(ValueError):
+            cmd._invoke()
+
+    def test_exception_stops_targets(self):
+        called = []
+
+        class Broken(self.Ping):
+            fanout_workers = 1
+
+            def __call__(self, target):
+                called.append(target)
+                if target == 'boom':
+                    raise ValueError(target)
+
+        cmd = Broken(
+            argparse.Namespace(hosts=['boom', 'a', 'b']), 'f', 'f', 'f')
+        with self.assertRaises(ValueError):
+            cmd._invoke()
+        time.sleep(0.1)
+        self.assertEqual(called, ['boom'])
@@ -0,0 +1,268 @@
+# This file is part of clilib
+# Copyright (C) 2012 Fraser Tweedale
+#
+# clilib is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from . import config
+
+
+class Config(config.Config):
+    def check_section(self, section):
+        if section == 'invalid':
+            raise UserWarning('invalid section')
+        return section
+
+
+class ShardedConfigTestCase(unittest.TestCase):
+    """Test the sharded (directory) configuration layout."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.write_file('alias.ini', '[alias]\nclose = update --closed\n')
+        self.write_file('a%2Fb.ini', '[a/b]\nx = 1\n')
+        self.write_file('DEFAULT.ini', '[DEFAULT]\ny = 2\n')
+        self.write_file('README', 'not a section')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_file(self, name, contents):
+        with open(os.path.join(self.path, name), 'w') as fh:
+            fh.write(contents)
+
+    def read_file(self, name):
+        with open(os.path.join(self.path, name)) as fh:
+            return fh.read()
+
+    def test_sections(self):
+        conf = Config(self.path)
+        self.assertTrue(conf.is_sharded())
+        self.assertEqual(conf.sections(), ['a/b', 'alias'])
+        self.assertEqual(conf._sections._loaded, {})
+
+    def test_lazy(self):
+        conf = Config(self.path)
+        self.assertEqual(conf.get('alias', 'close'), 'update --closed')
+        self.assertEqual(conf._sections._loaded.keys(), ['alias'])
+        self.assertEqual(conf.get('alias', 'y'), '2')
+
+    def test_write_changed_only(self):
+        conf = Config(self.path)
+        conf.set('alias', 'reop', 'update --reopened')
+        os.remove(os.path.join(self.path, 'a%2Fb.ini'))
+        conf.write()
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'a%2Fb.ini')))
+        self.assertEqual(
+            Config(self.path).items('alias'),
+            [('y', '2'), ('close', 'update --closed'),
+             ('reop', 'update --reopened')]
+        )
+
+    def test_add_remove_section(self):
+        conf = Config(self.path)
+        conf.add_section('new')
+        conf.set('new', 'z', '3')
+        conf.remove_section('alias')
+        conf.write()
+        self.assertEqual(self.read_file('new.ini'), '[new]\nz = 3\n\n')
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'alias.ini')))
+        self.assertEqual(Config(self.path).sections(), ['a/b', 'new'])
+
+    def test_check_section(self):
+        conf = Config(self.path)
+        with self.assertRaises(UserWarning):
+            conf.add_section('invalid')
+
+    def test_wrong_section(self):
+        self.write_file('c.ini', '[d]\nx = 1\n')
+        conf = Config(self.path)
+        with self.assertRaises(config.ConfigError):
+            conf.items('c')
+
+
+class FlatConfigTestCase(unittest.TestCase):
+    """Test the single-file configuration layout."""
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as fh:
+            fh.write('[alias]\nclose = update --closed\n')
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_read_write(self):
+        conf = Config(self.path)
+        self.assertFalse(conf.is_sharded())
+        conf.set('alias', 'reop', 'update --reopened')
+        conf.write()
+        self.assertEqual(
+            Config(self.path).items('alias'),
+            [('close', 'update --closed'), ('reop', 'update --reopened')]
+        )
+
+
+class JournalConfig(Config):
+    journal = True
+    journal_limit = 200
+
+
+class JournalConfigTestCase(unittest.TestCase):
+    """Test journaled configuration updates."""
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as fh:
+            fh.write('[alias]\nclose = update --closed\n')
+        self.journal = self.path + '.journal'
+
+    def tearDown(self):
+        for path in (self.path, self.journal):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def read(self, path):
+        with open(path) as fh:
+            return fh.read()
+
+    def test_append(self):
+        base = self.read(self.path)
+        conf = JournalConfig(self.path)
+        conf.set('alias', 'reop', 'update --reopened')
+        conf.add_section('new')
+        conf.write()
+        self.assertEqual(self.read(self.path), base)
+        self.assertEqual(len(self.read(self.journal).splitlines()), 2)
+
+        conf = JournalConfig(self.path)
+        self.assertEqual(conf.get('alias', 'reop'), 'update --reopened')
+        self.assertTrue(conf.has_section('new'))
+
+    def test_bytes(self):
+        """Values that are not valid UTF-8 are journaled unchanged."""
+        conf = JournalConfig(self.path)
+        conf.set('alias', 'latin', '\xff')
+        conf.write()
+        conf.set('alias', 'after', 'x')
+        conf.write()
+        conf = JournalConfig(self.path)
+        self.assertEqual(conf.get('alias', 'latin'), '\xff')
+        self.assertEqual(conf.get('alias', 'after'), 'x')
+        self.assertEqual(len(self.read(self.journal).splitlines()), 2)
+
+    def test_unicode(self):
+        conf = JournalConfig(self.path)
+        conf.set('alias', 'u', u'\u20ac')
+        conf.write()
+        conf = JournalConfig(self.path)
+        self.assertEqual(conf.get('alias', 'u'), '\xe2\x82\xac')
+
+    def test_remove(self):
+        conf = JournalConfig(self.path)
+        conf.remove_option('alias', 'close')
+        conf.remove_section('alias')
+        conf.write()
+        self.assertEqual(JournalConfig(self.path).sections(), [])
+
+    def test_compact(self):
+        conf = JournalConfig(self.path)
+        for i in range(10):
+            conf.set('alias', 'a{}'.format(i), str(i))
+            conf.write()
+        self.assertLess(os.path.getsize(self.journal), 200)
+        self.assertIn('a5 = 5', self.read(self.path))
+        conf = JournalConfig(self.path)
+        self.assertEqual(conf.get('alias', 'a9'), '9')
+
+    def test_truncated_record(self):
+        conf = JournalConfig(self.path)
+        conf.set('alias', 'one', '1')
+        conf.set('alias', 'two', '2')
+        conf.write()
+        data = self.read(self.journal)
+        for size in range(len(data.splitlines()[0]) + 1, len(data)):
+            with open(self.journal, 'w') as fh:
+                fh.write(data[:size])
+            conf = JournalConfig(self.path)
+            self.assertEqual(conf.get('alias', 'one'), '1')
+            self.assertFalse(conf.has_option('alias', 'two'))
+
+        # a later write discards the partial record
+        conf.set('alias', 'three', '3')
+        conf.write()
+        conf = JournalConfig(self.path)
+        self.assertEqual(conf.get('alias', 'three'), '3')
+        self.assertFalse(conf.has_option('alias', 'two'))
+
+    def test_corrupt_record(self):
+        conf = JournalConfig(self.path)
+        conf.set('alias', 'one', '1')
+        conf.set('alias', 'two', '2')
+        conf.write()
+        data = self.read(self.journal).replace('"1"', '"X"')
+        with open(self.journal, 'w') as fh:
+            fh.write(data)
+        conf = JournalConfig(self.path)
+        self.assertFalse(conf.has_option('alias', 'one'))
+        self.assertEqual(conf.get('alias', 'two'), '2')
+
+    def test_concurrent_writers(self):
+        """Compaction keeps changes journaled by another instance."""
+        a = JournalConfig(self.path)
+        b = JournalConfig(self.path)
+        b.set('alias', 'fromb', 'b')
+        b.write()
+        for i in range(10):
+            a.set('alias', 'a{}'.format(i), str(i))
+            a.write()
+        self.assertLess(os.path.getsize(self.journal), 200)
+        self.assertEqual(a.get('alias', 'fromb'), 'b')
+        conf = JournalConfig(self.path)
+        self.assertEqual(conf.get('alias', 'fromb'), 'b')
+        self.assertEqual(conf.get('alias', 'a9'), '9')
+
+    def test_compact_keeps_symlink_and_mode(self):
+        link = self.path + '.link'
+        os.chmod(self.path, 0o640)
+        os.symlink(self.path, link)
+        try:
+            conf = JournalConfig(link)
+            conf.set('alias', 'x', '1')
+            conf.write()
+            conf.compact()
+            self.assertTrue(os.path.islink(link))
+            self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+            self.assertIn('x = 1', self.read(self.path))
+        finally:
+            os.remove(link)
+            if os.path.exists(link + '.journal'):
+                os.remove(link + '.journal')
+
+    def test_replay_after_compaction(self):
+        """Replaying a journal that was already folded in is harmless."""
+        conf = JournalConfig(self.path)
+        conf.add_section('new')
+        conf.set('new', 'x', '1')
+        conf.write()
+        journal = self.read(self.journal)
+        conf.compact()
+        with open(self.journal, 'w') as fh:
+            fh.write(journal)
+        conf = JournalConfig(self.path)
+        self.assertEqual(conf.get('new', 'x'), '1')
@@ -15,7 +15,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import collections
+import os
+import pstats
 import re
+import shutil
+import StringIO
+import tempfile
+import threading
 import unittest
 
 from . import command
@@ -102,3 +108,313 @@ class DispatchTestCase(unittest.TestCase):
 
         with self.assertRaises(TypeError):
             disp.add_command(NotACommand)
+
+
+class Echo(command.Command):
+    """Echo the arguments."""
+    args = [
+        (['words'], dict(nargs='*')),
+    ]
+
+    def __call__(self):
+        if not self._args.words:
+            raise UserWarning('nothing to echo')
+        print >>self._stdout, ' '.join(self._args.words)
+
+
+class Fail(command.Command):
+    """Exit with the given status."""
+    args = [
+        (['status'], dict(type=int)),
+    ]
+
+    def __call__(self):
+        return self._args.status
+
+
+class RunTestCase(unittest.TestCase):
+    """Test ``Dispatcher.run``."""
+
+    def setUp(self):
+        self.disp = dispatch.Dispatcher()
+        self.disp.add_command(Echo)
+        self.disp.add_command(Fail)
+
+    def run_disp(self, *argv):
+        stdout, stderr = StringIO.StringIO(), StringIO.StringIO()
+        status = self.disp.run(argv, stdout=stdout, stderr=stderr)
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def test_output(self):
+        self.assertEqual(self.run_disp('echo', 'a', 'b'), (0, 'a b\n', ''))
+
+    def test_status(self):
+        self.assertEqual(self.run_disp('fail', '3'), (3, '', ''))
+        self.assertEqual(self.run_disp('fail', '0'), (0, '', ''))
+
+    def test_help(self):
+        status, out, err = self.run_disp('--help')
+        self.assertEqual(status, 0)
+        self.assertIn('subcommands', out)
+        self.assertEqual(err, '')
+
+    def test_help_command(self):
+        status, out, err = self.run_disp('help', 'echo')
+        self.assertEqual(status, 0)
+        self.assertIn('usage:', out)
+
+    def test_parse_error(self):
+        status, out, err = self.run_disp('bogus')
+        self.assertEqual(status, 2)
+        self.assertEqual(out, '')
+        self.assertIn('error:', err)
+
+    def test_user_warning(self):
+        status, out, err = self.run_disp('echo')
+        self.assertEqual(status, 1)
+        self.assertIn('nothing to echo', err)
+
+    def test_parsers_reused(self):
+        self.run_disp('echo', 'a')
+        parsers = self.disp._parsers
+        self.run_disp('echo', 'b')
+        self.assertIs(self.disp._parsers, parsers)
+        self.disp.add_command(command.Config)
+        self.run_disp('echo', 'c')
+        self.assertIsNot(self.disp._parsers, parsers)
+
+    def test_threads(self):
+        results = {}
+
+        def target(i):
+            results[i] = self.run_disp('echo', str(i))
+
+        threads = [
+            threading.Thread(target=target, args=(i,)) for i in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for i in range(20):
+            self.assertEqual(results[i], (0, '{}\n'.format(i), ''))
+
+
+class ResourceTestCase(unittest.TestCase):
+    """Test dispatcher resources."""
+
+    class Use(command.Command):
+        """Use the database."""
+        resources = ('db',)
+
+        def __call__(self):
+            print >>self._stdout, self._resources['db']
+
+    def setUp(self):
+        self.created = []
+        self.torn_down = []
+        self.disp = dispatch.Dispatcher()
+        self.disp.add_command(self.Use)
+        self.disp.add_resource('db', self.setup, self.torn_down.append)
+
+    def setup(self):
+        self.created.append(len(self.created))
+        return self.created[-1]
+
+    def run_disp(self, *argv):
+        stdout = StringIO.StringIO()
+        self.disp.run(argv, stdout=stdout, stderr=StringIO.StringIO())
+        return stdout.getvalue()
+
+    def test_lazy(self):
+        self.run_disp('help')
+        self.assertEqual(self.created, [])
+
+    def test_reused(self):
+        self.assertEqual(self.run_disp('use'), '0\n')
+        self.assertEqual(self.run_disp('use'), '0\n')
+        self.assertEqual(self.created, [0])
+
+    def test_close(self):
+        with self.disp:
+            self.run_disp('use')
+            self.assertEqual(self.torn_down, [])
+        self.assertEqual(self.torn_down, [0])
+
+    def test_duplicate(self):
+        with self.assertRaises(ValueError):
+            self.disp.add_resource('db', object)
+
+    def test_abandoned_fanout_target(self):
+        """Instances still used by a timed out target are not reused."""
+        release = threading.Event()
+        seen = []
+
+        class Slow(command.Command):
+            """Use the database slowly."""
+            args = [
+                (['targets'], dict(nargs='+')),
+            ]
+            resources = ('db',)
+            fanout = 'targets'
+            fanout_timeout = 0.1
+
+            def __call__(self, target):
+                seen.append(self._resources['db'])
+                release.wait(3)
+
+        self.disp.add_command(Slow)
+        try:
+            self.run_disp('slow', 'a')
+            self.run_disp('slow', 'b')
+        finally:
+            release.set()
+        self.assertEqual(seen, [0, 1])
+        self.disp.close()
+        self.assertEqual(self.torn_down, [])
+
+    def test_unknown(self):
+        class Other(command.Command):
+            """Use an unknown resource."""
+            resources = ('bogus',)
+
+            def __call__(self):
+                pass
+
+        self.disp.add_command(Other)
+        with self.assertRaises(KeyError):
+            self.run_disp('other')
+
+
+def busy():
+    return sum(range(1000))
+
+
+class Work(command.Command):
+    """Do some work for each target."""
+    args = [
+        (['targets'], dict(nargs='+')),
+    ]
+    fanout = 'targets'
+
+    def __call__(self, target):
+        busy()
+
+
+class ProfileTestCase(unittest.TestCase):
+    """Test the ``--profile`` option."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'out.pstats')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_disp(self, argv, **kwargs):
+        disp = dispatch.Dispatcher(
+            global_args=[(['--verbose'], dict(action='store_true'))],
+            **kwargs
+        )
+        disp.add_command(Echo)
+        disp.add_command(Fail)
+        stdout, stderr = StringIO.StringIO(), StringIO.StringIO()
+        status = disp.run(argv, stdout=stdout, stderr=stderr)
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def folded(self):
+        with open(self.path + '.folded') as fh:
+            return fh.read()
+
+    def test_profile(self):
+        status, out, err = self.run_disp(
+            ['--verbose', '--profile=' + self.path, 'echo', 'hi'],
+            with_profile=True
+        )
+        self.assertEqual((status, out), (0, 'hi\n'))
+        self.assertIn('function calls', err)
+        self.assertIn(':__call__', self.folded())
+        self.assertNotIn(':parse_known_args', self.folded())
+        pstats.Stats(self.path)
+
+    def test_profile_dispatch(self):
+        status, out, err = self.run_disp(
+            ['--profile=' + self.path, 'echo', 'hi'],
+            with_profile=True, profile_dispatch=True
+        )
+        self.assertEqual((status, out), (0, 'hi\n'))
+        self.assertIn(':parse_known_args', self.folded())
+
+    def test_help(self):
+        status, out, err = self.run_disp(
+            ['--profile=' + self.path, '--help'], with_profile=True)
+        self.assertEqual(status, 0)
+        self.assertIn('no profile data collected', err)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_parse_error(self):
+        status, out, err = self.run_disp(
+            ['--profile=' + self.path, 'bogus'], with_profile=True)
+        self.assertEqual(status, 2)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_unwritable(self):
+        path = os.path.join(self.tmpdir, 'missing', 'out.pstats')
+        status, out, err = self.run_disp(
+            ['--profile=' + path, 'echo', 'hi'], with_profile=True)
+        self.assertEqual((status, out), (1, 'hi\n'))
+        self.assertIn('cannot write profile to ' + path, err)
+
+    def test_unwritable_keeps_failure_status(self):
+        path = os.path.join(self.tmpdir, 'missing', 'out.pstats')
+        status, out, err = self.run_disp(
+            ['--profile=' + path, 'fail', '3'], with_profile=True)
+        self.assertEqual(status, 3)
+        self.assertIn('cannot write profile to ' + path, err)
+
+    def test_fanout(self):
+        """Fan-out targets, which run on other threads, are profiled."""
+        disp = dispatch.Dispatcher(with_profile=True)
+        disp.add_command(Work)
+        stderr = StringIO.StringIO()
+        status = disp.run(
+            ['--profile=' + self.path, 'work', 'a', 'b'],
+            stdout=StringIO.StringIO(), stderr=stderr
+        )
+        self.assertEqual(status, 0)
+        self.assertIn(':busy', self.folded())
+
+    def test_listed_in_help(self):
+        status, out, err = self.run_disp(['--help'], with_profile=True)
+        self.assertIn('--profile [PATH]', out)
+        status, out, err = self.run_disp(['--help'])
+        self.assertNotIn('--profile', out)
+
+    def test_conflicting_global_arg(self):
+        with self.assertRaises(ValueError):
+            dispatch.Dispatcher(
+                global_args=[(['--profile'], dict(action='store_true'))],
+                with_profile=True
+            )
+        dispatch.Dispatcher(
+            global_args=[(['--profile'], dict(action='store_true'))])
+
+    def test_option_after_command(self):
+        status, out, err = self.run_disp(
+            ['echo', '--profile=' + self.path], with_profile=True)
+        self.assertEqual(status, 2)
+        self.assertIn('--profile must precede the command', err)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_after_command(self):
+        """``--profile`` after ``--`` is passed to the command."""
+        status, out, err = self.run_disp(
+            ['echo', '--', '--profile=' + self.path], with_profile=True)
+        self.assertEqual(out, '--profile={}\n'.format(self.path))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_without_profile(self):
+        status, out, err = self.run_disp(
+            ['--profile=' + self.path, 'echo', 'hi'])
+        self.assertEqual(status, 2)
+        self.assertFalse(os.path.exists(self.path))
@@ -0,0 +1,68 @@
+# This file is part of clilib
+# Copyright (C) 2012 Fraser Tweedale
+#
+# clilib is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from . import profiling
+
+
+class FakeStats(object):
+    """Stand-in for ``pstats.Stats`` with hand-written timings."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+
+MAIN = ('main.py', 1, 'main')
+A = ('main.py', 10, 'a')
+B = ('lib.py', 5, 'b')
+LEN = ('~', 0, '<len>')
+
+
+class CollapseTestCase(unittest.TestCase):
+
+    def test_label(self):
+        self.assertEqual(profiling.label(MAIN), 'main.py:1:main')
+        self.assertEqual(profiling.label(('/x/y.py', 2, 'f')), 'y.py:2:f')
+        self.assertEqual(profiling.label(LEN), '<len>')
+
+    def test_collapse(self):
+        # main calls a and b; a calls b; b calls len
+        stats = FakeStats({
+            MAIN: (1, 1, 1.0, 10.0, {}),
+            A: (1, 1, 2.0, 4.0, {MAIN: (1, 1, 2.0, 4.0)}),
+            B: (3, 3, 4.0, 5.0, {
+                MAIN: (1, 1, 2.0, 3.0), A: (2, 2, 2.0, 2.0)}),
+            LEN: (3, 3, 1.0, 1.0, {B: (3, 3, 1.0, 1.0)}),
+        })
+        self.assertEqual(profiling.collapse(stats), {
+            'main.py:1:main': 1000000,
+            'main.py:1:main;main.py:10:a': 2000000,
+            'main.py:1:main;main.py:10:a;lib.py:5:b': 1600000,
+            'main.py:1:main;main.py:10:a;lib.py:5:b;<len>': 400000,
+            'main.py:1:main;lib.py:5:b': 2400000,
+            'main.py:1:main;lib.py:5:b;<len>': 600000,
+        })
+
+    def test_recursion(self):
+        stats = FakeStats({
+            MAIN: (1, 1, 1.0, 3.0, {}),
+            A: (1, 3, 2.0, 2.0, {MAIN: (1, 1, 1.0, 2.0), A: (0, 2, 1.0, 1.0)}),
+        })
+        self.assertEqual(profiling.collapse(stats), {
+            'main.py:1:main': 1000000,
+            'main.py:1:main;main.py:10:a': 2000000,
+        })
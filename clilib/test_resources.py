@@ -0,0 +1,73 @@
+# This file is part of clilib
+# Copyright (C) 2012 Fraser Tweedale
+#
+# clilib is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import itertools
+import unittest
+
+from . import resources
+
+
+class ResourcePoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.counter = itertools.count()
+        self.torn_down = []
+        self.pool = resources.ResourcePool(
+            lambda: next(self.counter), self.torn_down.append)
+
+    def test_lazy(self):
+        calls = []
+        pool = resources.ResourcePool(lambda: calls.append(None))
+        self.assertEqual(calls, [])
+        pool.acquire()
+        self.assertEqual(calls, [None])
+
+    def test_reuse(self):
+        a = self.pool.acquire()
+        self.pool.release(a)
+        self.assertEqual(self.pool.acquire(), a)
+
+    def test_exclusive(self):
+        a = self.pool.acquire()
+        b = self.pool.acquire()
+        self.assertNotEqual(a, b)
+
+    def test_close(self):
+        a = self.pool.acquire()
+        b = self.pool.acquire()
+        self.pool.release(a)
+        self.pool.close()
+        self.assertItemsEqual(self.torn_down, [a, b])
+        self.assertNotIn(self.pool.acquire(), [a, b])
+
+    def test_release_after_close(self):
+        a = self.pool.acquire()
+        self.pool.close()
+        self.pool.release(a)
+        self.assertEqual(self.torn_down, [a])
+        self.assertNotEqual(self.pool.acquire(), a)
+
+    def test_discard(self):
+        a = self.pool.acquire()
+        self.pool.discard(a)
+        self.assertNotEqual(self.pool.acquire(), a)
+        self.pool.close()
+        self.assertNotIn(a, self.torn_down)
+
+    def test_no_teardown(self):
+        pool = resources.ResourcePool(object)
+        pool.acquire()
+        pool.close()
@@ -18,6 +18,10 @@
 clilib utility functions.
 """
 
+import argparse
+import functools
+import sys
+
 
 def add_arg_to_parser(arg, parser):
     """Add the argument to the given parser.
@@ -31,3 +35,56 @@ def add_arg_to_parser(arg, parser):
         arg(parser)
     else:
         parser.add_argument(*arg[0], **arg[1])
+
+
+class ParserExit(Exception):
+    """Raised by ``ArgumentParser`` in place of ``sys.exit``.
+
+    The ``status`` attribute holds the exit status argparse asked for.
+    """
+
+    def __init__(self, status=0):
+        super(ParserExit, self).__init__(status)
+        self.status = status
+
+
+class ArgumentParser(argparse.ArgumentParser):
+    """An ``argparse.ArgumentParser`` that leaves the interpreter alone.
+
+    Help and usage are written to the ``stdout`` and ``stderr``
+    attributes of the ``streams`` object (typically a
+    ``threading.local``), falling back to ``sys.stdout`` and
+    ``sys.stderr`` when they are not set.  Rather than calling
+    ``sys.exit``, ``ParserExit`` is raised.
+
+    Subparsers are created with the same ``streams`` object.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._streams = kwargs.pop('streams')
+        super(ArgumentParser, self).__init__(*args, **kwargs)
+
+    def add_subparsers(self, **kwargs):
+        kwargs.setdefault(
+            'parser_class',
+            functools.partial(type(self), streams=self._streams)
+        )
+        return super(ArgumentParser, self).add_subparsers(**kwargs)
+
+    def _stream(self, name):
+        return getattr(self._streams, name, None) or getattr(sys, name)
+
+    def print_usage(self, file=None):
+        super(ArgumentParser, self).print_usage(file or self._stream('stdout'))
+
+    def print_help(self, file=None):
+        super(ArgumentParser, self).print_help(file or self._stream('stdout'))
+
+    def exit(self, status=0, message=None):
+        if message:
+            self._print_message(message, self._stream('stderr'))
+        raise ParserExit(status)
+
+    def error(self, message):
+        self.print_usage(self._stream('stderr'))
+        self.exit(2, '{}: error: {}\n'.format(self.prog, message))
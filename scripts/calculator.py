@@ -13,7 +13,7 @@ class CalculatorCommand(clilib.Command):
         else:
             mapper = lambda x: int(x)
         inputs = (mapper(x) for x in self._args.inputs)
-        print reduce(self._reduce, inputs)
+        print >>self._stdout, reduce(self._reduce, inputs)
 
 
 class Add(CalculatorCommand):